@@ -7,37 +7,125 @@ import os
 from shutil import copy2
 import re
 import difflib
+import importlib.util
+import math
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from heapq import nlargest
+from operator import itemgetter
 from random import choice as ch
 from zipfile import ZipFile as ZF
 import sqlite3
 from datetime import datetime
 from time import time
+# optional: C++ implementation of similarity ratios (process.cdist requires numpy)
+if importlib.util.find_spec("rapidfuzz") and importlib.util.find_spec("numpy"): from rapidfuzz import fuzz, process
+else: process = None
+
+### CONSTANTS ###
+
+BOOK_EXTENSIONS = (".pdf", ".azw", ".epub", ".mobi")
+EXTENSIONS = (".epub", ".mobi", ".pdf") # extensions of books checked for subtitles and compared
+REFLOWABLE_EXTENSIONS = (".epub", ".mobi")
+COVER_FILENAMES = ("cover.jpg", "cover.jpeg") # covers at the root of .epub archive
+ARTICLES = frozenset(("A", "An", "The", # English
+                      "El", "La", "Los", "Las", "Un", "Una", "Unos", "Unas", # Spanish
+                      "Le", "L'", "Les", "Une", "Des", # French
+                      "Der", "Die", "Das", "Ein", "Eine")) # German
+ARTICLE_PREFIXES = tuple(article + " " for article in sorted(ARTICLES))
+STOPWORDS = frozenset(("a", "an", "and", "as", "at", "by", "das", "de", "degli", "dei", "del", "dell", "della",
+                       "delle", "delli", "dello", "der", "des", "du", "ed.", "ein", "eine", "el", "for",
+                       "from", "il", "in", "into", "la", "las", "le", "les", "los", "nor", "of", "on", "onto",
+                       "or", "the", "to", "tr.", "un", "una", "une", "uno", "unto", "unas", "unos", "ur.",
+                       "van", "von", "with")) # words not capitalized in titles
+RE_ARTICLE = re.compile(r",\s(" + "|".join(sorted(ARTICLES, key=lambda a: (-len(a), a))) + r")(?=\.\w+$)") # finds a trailing article of a title
+RE_MULTIPLE_SPACING = re.compile(r"\s{2,}")
+RE_COMMA_BEFORE = re.compile(r"\s,") # finds comma preceded by spacing
+RE_COMMA_AFTER = re.compile(r",(?=\S)(?!\d)") # finds comma not followed by spacing or number
+RE_APOSTROPHE = re.compile(r"(?<=[A-Za-z])_(?=[A-Za-z])")
+RE_HYPHEN = re.compile(r"(\S-\S)|(\S-\s)|(\s-\S)")
+RE_AUTHOR = re.compile(r".+,.+-")
+PUNCTUATION = str.maketrans("", "", ",-!'_()") # removes punctuation ignored when checking capitalization
+SIMILARITY = 0.9 # min similarity ratio of similar filenames
+SHINGLE = 3 # length of substrings of filenames indexed for finding candidates for similarity
+ROWS = 1000 # max number of filenames compared at once by rapidfuzz (limits memory used by matrix of similarity ratios)
+MENU = "\n".join(("",
+                  "0: enter new path",
+                  "1: refresh list of books from path",
+                  "2: select individual books for processing",
+                  "3: remove multiple spacing",
+                  "4: fix comma spacing",
+                  "5: fix apostrophes",
+                  "6: find hyphen without spacing",
+                  "7: find possible missing authors at the start",
+                  "8: find possible missing capitalization",
+                  "9: find books containing possible subtitles",
+                  "10: preserve title(s) only (crop author(s), subtitle(s))",
+                  "11: preserve author(s) and title(s) (crop subtitle(s))",
+                  "12: restore author(s) data to filename(s) w/o author(s) data",
+                  "13: remove substring from filename",
+                  "14: restore filenames after modification",
+                  "15: compare filenames from two directories",
+                  "16: compare filenames within single directory",
+                  "17: compare file sizes of identical books",
+                  "18: find image files above threshold size (.epub format only)",
+                  "19: list all cover.jp[e]g files and \\images directories sorted by size (.epub format only)",
+                  "20: check the database on Kobo device for inaccurate collections data",
+                  "21: remove inaccurate collections data from the database on Kobo device",
+                  "22: choose a book at random",
+                  "",
+                  "Enter number, H+number for help, or X for exit: ")) # main menu options
 
 ### FUNCTIONS ###
 
 def getPath():
     """
     Returns path to directory with book filenames entered as input from user.
+    Repeats input until an existing directory is entered.
     :return: path to directory with book filenames
     """
-    path = input("\nEnter path to directory with books: ")
-    if path[-1] != "\\": path = path + "\\"
-    return path
+    while True:
+        entered = input("\nEnter path to directory with books: ")
+        if not entered:
+            print("\nNo path entered. Enter a valid path.")
+            continue
+        path = os.path.normpath(entered)
+        if os.path.isdir(path): return path
+        print("\nDirectory {} not found. Enter a valid path.".format(path))
+
+def getComparePath():
+    """
+    Returns path to other directory with book filenames to compare entered as input from user.
+    Repeats input until an existing directory is entered.
+    Empty input reuses the previously entered directory (stored in compare_path), if any.
+    :return: path to other directory with book filenames
+    """
+    global compare_path
+    while True:
+        if compare_path: entered = input("Enter path to other directory with books to compare or Enter for {}: ".format(compare_path))
+        else: entered = input("Enter path to other directory with books to compare: ")
+        if not entered and compare_path: return compare_path
+        if not entered:
+            print("\nNo path entered. Enter a valid path.")
+            continue
+        path2 = os.path.normpath(entered)
+        if os.path.isdir(path2):
+            compare_path = path2
+            return path2
+        print("\nDirectory {} not found. Enter a valid path.".format(path2))
 
 def getBooks(path):
     """
     Gets a list of book filenames from a given path.
-    Valid extensions: .pdf, .azw, .epub, .mobi
+    Valid extensions (case-insensitive): .pdf, .azw, .epub, .mobi
     :param path: full path to a directory with files searched for book filenames
     :return: list of all book filenames from path
     """
-    books = os.listdir(path)
-    for book in books[:]:
-        if not (re.search(r".pdf$", book)\
-                or re.search(r".azw$", book)\
-                or re.search(r".epub$", book)\
-                or re.search(r".mobi$", book)): books.remove(book)
-    return books
+    with os.scandir(path) as entries:
+        return [entry.name for entry in entries
+                if entry.is_file() and entry.name.lower().endswith(BOOK_EXTENSIONS)]
 
 def sortBooks(path, books):
     """
@@ -51,37 +139,27 @@ def sortBooks(path, books):
         sorting = input("\nSort by author (A), title (T), date modified (D) or size descending (S)? A/N/D/S ")
         if sorting.lower() in ["a", "t", "d", "s"]: break
         else: print("\nEnter a valid choice.\n")
-    if sorting.lower() == "a": return sorted(books, key=lambda s: s.lower()), "by author", None
+    if sorting.lower() == "a": return sorted(books, key=str.lower), "by author", None
     elif sorting.lower() == "t":
         by_title = list()
-        sorted_by_title = list()
         for book in books:
-            title = re.sub(r".+\s-\s", "", book)
-            if title.split()[0] in ("A", "An", "The", "El", "La", "Los", "Las", "Un", "Una",
-                                                           "Unos", "Unas", "Le", "L'", "Les", "Une", "Des", "Der",
-                                                           "Die", "Das", "Ein", "Eine"):
-                by_title.append((re.sub(r"^\w+\s", "", title), book))
-            else: by_title.append((title, book))
-        for book in sorted(by_title, key=lambda s: s[0].lower()): sorted_by_title.append(book[1])
-        return sorted_by_title, "by title", None
-    elif sorting.lower() == "d":
-        by_date = list()
-        dates = list()
-        sorted_by_date = list()
-        for book in books: by_date.append((str(datetime.fromtimestamp(int(os.stat(path + book).st_mtime))), book))
-        for book in sorted(by_date, reverse=True):
-            dates.append(book[0])
-            sorted_by_date.append(book[1])
-        return sorted_by_date, "by date modified", dates
+            title = book.rpartition(" - ")[2]
+            if title.startswith(ARTICLE_PREFIXES): by_title.append((title.split(" ", 1)[1].lower(), book))
+            else: by_title.append((title.lower(), book))
+        by_title.sort(key=itemgetter(0))
+        return [book for title, book in by_title], "by title", None
+    # directory entries carry file attributes from the directory scan, so no separate os.stat call per book
+    with os.scandir(path) as scan:
+        selected = set(books)
+        entries = [entry for entry in scan if entry.name in selected]
+    if sorting.lower() == "d":
+        by_date = sorted(((int(entry.stat().st_mtime), entry.name) for entry in entries), reverse=True)
+        dates = [str(datetime.fromtimestamp(date)) for date, book in by_date]
+        return [book for date, book in by_date], "by date modified", dates
     else:
-        by_size = list()
-        sizes = list()
-        sorted_by_size = list()
-        for book in books: by_size.append((int(os.stat(path + book).st_size), book))
-        for book in sorted(by_size, reverse=True):
-            sizes.append(str(book[0]) + " bytes")
-            sorted_by_size.append(book[1])
-        return sorted_by_size, "by size", sizes
+        by_size = sorted(((entry.stat().st_size, entry.name) for entry in entries), reverse=True)
+        sizes = ["{} bytes".format(size) for size, book in by_size]
+        return [book for size, book in by_size], "by size", sizes
 
 def selectBooks():
     """
@@ -98,15 +176,14 @@ def selectBooks():
     """
     sorted_books, sorted_by, details = sortBooks(path, books)
     print("\nBooks sorted {}:\n".format(sorted_by))
+    rows = list()
     if details:
-        counter = 0
-        for book in enumerate(sorted_books, start=1):
-            if len(book[1]) >= 60: print("{:>4} {:<60} {:>19}".format(book[0], book[1][:54] + "...", details[counter]))
-            else: print("{:>4} {:<60} {:>19}".format(book[0], book[1], details[counter]))
-            #print(book[0], book[1], details[0])
-            counter += 1
+        for number, (book, detail) in enumerate(zip(sorted_books, details), start=1):
+            if len(book) >= 60: rows.append("{:>4} {:<60} {:>19}".format(number, book[:54] + "...", detail))
+            else: rows.append("{:>4} {:<60} {:>19}".format(number, book, detail))
     else:
-        for book in enumerate(sorted_books, start=1): print(book[0], book[1])
+        for book in enumerate(sorted_books, start=1): rows.append("{} {}".format(book[0], book[1]))
+    print("\n".join(rows))
     while True:
         try:
             selected = input("\nSelect books by individual numbers or ranges (from-to), separated by commas: ")
@@ -119,7 +196,7 @@ def selectBooks():
                 else: numbers.add(int(selection) - 1)
             for number in numbers: selected_books.append(sorted_books[number])
             print("\nSelected books ({}):\n".format(len(selected_books)))
-            for book in enumerate(selected_books, start=1): print("{:>4} {}".format(book[0], book[1]))
+            print("\n".join("{:>4} {}".format(book[0], book[1]) for book in enumerate(selected_books, start=1)))
             return selected_books
         except: print("\nIncorrect input for selected books. Enter a valid input.")
 
@@ -132,35 +209,38 @@ def removeMultipleSpacing(path, books, undo):
     """
     undo.clear()
     counter = 0
-    for book in books:
-        old = book
-        spacing = False
-        if ".epub" in book.lower() or ".mobi" in book.lower():
-            while True:
-                if book[-6] == " ":
-                    book = book[:-6] + book[-5:]
-                    spacing = True
-                else: break
-        elif ".pdf" in book.lower():
-            while True:
-                if book[-5] == " ":
-                    book = book[:-5] + book[-4:]
-                    spacing = True
-                else: break
-        if re.search(r"\s{2,}", book):
-            book = re.sub(r"\s{2,}", " ", book)
-            os.rename(path + old, path + book)
-            spacing = True
-        if spacing:
-            undo[book] = old
-            counter +=1
-            print("Multiple and/or end spacing removed from filename: {}; new filename: {}".format(path + old, book))
+    with dirRenamer(path) as rename:
+        for book in books:
+            old = book
+            spacing = False
+            extension = book[-5:].lower()
+            if extension in REFLOWABLE_EXTENSIONS:
+                while True:
+                    if book[-6] == " ":
+                        book = book[:-6] + book[-5:]
+                        spacing = True
+                    else: break
+            elif extension.endswith(".pdf"):
+                while True:
+                    if book[-5] == " ":
+                        book = book[:-5] + book[-4:]
+                        spacing = True
+                    else: break
+            if RE_MULTIPLE_SPACING.search(book):
+                book = RE_MULTIPLE_SPACING.sub(" ", book)
+                spacing = True
+            if spacing:
+                source = os.path.join(path, old)
+                rename(old, book)
+                undo[book] = old
+                counter += 1
+                print("Multiple and/or end spacing removed from filename: {}; new filename: {}".format(source, book))
     print("\nProcess finished. Multiple spacing removed from {} filenames.".format(str(counter)))
 
 def fixCommaSpacing(path, books, undo):
     """
     Fixes commas preceded by spacing ([char] ,) or not followed by spacing (,[char]) to appropriate form ([char], )
-    !!! Ignores comma between numbers (e.g. 10,000). !!!
+    !!! Ignores comma followed by number (e.g. 10,000). !!!
     !!! Removing multiple spacing prior to and/or after fixing commas is recommended. !!!
     Stores new and old filenames to undo dictionary allowing restoration of modified filenames via undo method.
     :param path: full path to a directory with files to be modified
@@ -168,21 +248,16 @@ def fixCommaSpacing(path, books, undo):
     """
     undo.clear()
     counter = 0
-    for book in books:
-        old = book
-        changed = False
-        if re.search(r"(\s,)", book):
-            book = re.sub(r"\s,", ",", book)
-            os.rename(path + old, path + book)
-            changed = True
-        if re.search(r",\S", book) and not re.search(r",\d", book):
-            book = re.sub(r",", ", ", book)
-            os.rename(path + old, path + book)
-            changed = True
-        if changed:
-            undo[book] = old
-            counter += 1
-            print("Comma spacing fixed in filename: {}; new filename: {}".format(path + old, book))
+    with dirRenamer(path) as rename:
+        for book in books:
+            old = book
+            book = RE_COMMA_AFTER.sub(", ", RE_COMMA_BEFORE.sub(",", book))
+            if book != old:
+                source = os.path.join(path, old)
+                rename(old, book)
+                undo[book] = old
+                counter += 1
+                print("Comma spacing fixed in filename: {}; new filename: {}".format(source, book))
     print("\nProcess finished. Comma spacing fixed in {} filenames.".format(str(counter)))
 
 def fixApostrophes(path, books, undo):
@@ -194,14 +269,15 @@ def fixApostrophes(path, books, undo):
     """
     undo.clear()
     counter = 0
-    for book in books:
-        if re.search(r"[A-Za-z]_[A-Za-z]", book):
-            old = book
-            book = re.sub(r"(?<=[A-Za-z])_(?=[A-Za-z])", "'", book)
-            os.rename(path + old, path + book)
-            counter += 1
-            undo[book] = old
-            print(old, "changed to", book)
+    with dirRenamer(path) as rename:
+        for book in books:
+            if RE_APOSTROPHE.search(book):
+                old = book
+                book = RE_APOSTROPHE.sub("'", book)
+                rename(old, book)
+                counter += 1
+                undo[book] = old
+                print(old, "changed to", book)
     print("\nProcess finished. Apostrophes fixed in {} filenames.".format(str(counter)))
 
 def findHypenWithoutSpacing(path, books):
@@ -213,12 +289,12 @@ def findHypenWithoutSpacing(path, books):
     :param path: full path to a directory with files to be searched
     :param books: list of filenames to find hyphen without spacing in
     """
-    counter = 0
+    found = list()
     for book in books:
-        if re.search(r"(\.epub)|(\.mobi)", book) and re.search(r"(\S-\S)|(\S-\s)|(\s-\S)", book):
-            counter += 1
-            print("Hyphen without spacing found in filename: {}".format(path + book))
-    print("\nProcess finished. Hyphen without spacing found in {} filenames.".format(str(counter)))
+        if book.lower().endswith(REFLOWABLE_EXTENSIONS) and RE_HYPHEN.search(book):
+            found.append("Hyphen without spacing found in filename: {}".format(os.path.join(path, book)))
+    if found: print("\n".join(found))
+    print("\nProcess finished. Hyphen without spacing found in {} filenames.".format(str(len(found))))
 
 def findNoAuthorFirst(path, books):
     """
@@ -228,12 +304,12 @@ def findNoAuthorFirst(path, books):
     :param path: full path to a directory with files to be searched
     :param books: list of filenames to find missing authors at the start in
     """
-    counter = 0
+    found = list()
     for book in books:
-        if re.search(r"(\.epub)|(\.mobi)", book) and not re.search(r".+,.+-", book):
-            counter += 1
-            print("Possible missing author at the start found in filename: {}".format(path + book))
-    print("\nProcess finished. Possible missing authors found in {} filenames.".format(str(counter)))
+        if book.lower().endswith(REFLOWABLE_EXTENSIONS) and not RE_AUTHOR.search(book):
+            found.append("Possible missing author at the start found in filename: {}".format(os.path.join(path, book)))
+    if found: print("\n".join(found))
+    print("\nProcess finished. Possible missing authors found in {} filenames.".format(str(len(found))))
 
 def findMissingCapitalization(path, books):
     """
@@ -249,18 +325,16 @@ def findMissingCapitalization(path, books):
     :param books: list of filenames to find missing capitalization in
     """
     counter = 0
+    found = list()
     for book in books:
-        if re.search(r"(\.epub)|(\.mobi)", book):
+        if book.lower().endswith(REFLOWABLE_EXTENSIONS):
             noncapitalized = False
-            for word in re.sub(r"[,\-!'_()]", "", book[:-5]).split():
-                if word not in ("a", "an", "and", "as", "at", "by", "das", "de", "degli", "dei", "del", "dell", "della",
-                                "delle", "delli", "dello", "der", "des", "du", "ed.", "ein", "eine", "el", "for",
-                                "from", "il", "in", "into", "la", "las", "le", "les", "los", "nor", "of", "on", "onto",
-                                "or", "the", "to", "tr.", "un", "una", "une", "uno", "unto", "unas", "unos", "ur.",
-                                "van", "von", "with") and word[0].islower():
+            for word in book[:-5].translate(PUNCTUATION).split():
+                if word not in STOPWORDS and word[0].islower():
                     noncapitalized = True
-                    print("Possible missing capitalization in word: '{}' in filename: {}".format(word, path + book))
+                    found.append("Possible missing capitalization in word: '{}' in filename: {}".format(word, os.path.join(path, book)))
             if noncapitalized: counter += 1
+    if found: print("\n".join(found))
     print("\nProcess finished. Possible missing capitalization found in {} filenames.".format(str(counter)))
 
 def findSubtitles(books):
@@ -269,15 +343,12 @@ def findSubtitles(books):
     Lists books containing possible subtitles.
     :param books: list of filenames to be checked for possible subtitles
     """
-    counter = 0
+    found = list()
     for book in books:
-        if re.search(r"\.epub", book.lower())\
-                or re.search(r"\.mobi", book.lower())\
-                or re.search(r"\.pdf", book.lower()):
-            if "_" in book:
-                counter += 1
-                print("Possible subtitle found in book {}".format(book))
-    print("\nProcess finished. Possible subtitles found in {} filenames.".format(str(counter)))
+        if book.lower().endswith(EXTENSIONS):
+            if "_" in book: found.append("Possible subtitle found in book {}".format(book))
+    if found: print("\n".join(found))
+    print("\nProcess finished. Possible subtitles found in {} filenames.".format(str(len(found))))
 
 def withoutAuthors(path, books, undo):
     """
@@ -288,29 +359,19 @@ def withoutAuthors(path, books, undo):
     :param books: list of filenames to be modified
     """
     undo.clear()
-    pattern1 = re.compile(r".+?\s-\s") # finds author(s)
-    pattern2 = re.compile(r"_+\s.+(?=\.)") # finds a subtitle of a book
-    for book in books:
-        old = book
-        os.rename(path + book, path + re.sub(pattern1, "", book, 1))
-        noauthor = re.sub(pattern1, "", book, 1)
-        if re.search(r".+(, A)\.", noauthor[-9:]):
-            os.rename(path + noauthor, path + "A " + re.sub(pattern2, "", re.sub(",\sA\.", ".", noauthor), 1))
-            new = "A " + re.sub(pattern2, "", re.sub(",\sA\.", ".", noauthor), 1)
-        elif re.search(r".+(, An)\.", noauthor[-10:]):
-            os.rename(path + noauthor, path + "An " + re.sub(pattern2, "", re.sub(",\sAn\.", ".", noauthor), 1))
-            new = "An " + re.sub(pattern2, "", re.sub(",\sAn\.", ".", noauthor), 1)
-        elif re.search(r".+(, The)\.", noauthor[-11:]):
-            os.rename(path + noauthor, path + "The " + re.sub(pattern2, "", re.sub(",\sThe\.", ".", noauthor), 1))
-            new = "The " + re.sub(pattern2, "", re.sub(",\sThe\.", ".", noauthor), 1)
-        else:
-            os.rename(path + noauthor, path + re.sub(pattern2, "", noauthor, 1))
-            new = re.sub(pattern2, "", noauthor, 1)
-        if new[-1] == "_":
-            os.rename(path + new, path + new[:-1])
-            new = new[:-1]
-        undo[new] = old
-        print(old, "changed to", new)
+    with dirRenamer(path) as rename:
+        for book in books:
+            old = book
+            author, dash, noauthor = book.partition(" - ")
+            if not dash: noauthor = book
+            match = RE_ARTICLE.search(noauthor)
+            if match and match.group(1) in ("A", "An", "The"):
+                new = match.group(1) + " " + cropSubtitle(noauthor[:match.start()] + noauthor[match.end():])
+            else: new = cropSubtitle(noauthor)
+            if new[-1] == "_": new = new[:-1]
+            rename(old, new)
+            undo[new] = old
+            print(old, "changed to", new)
 
 def withAuthors(path, books, undo):
     """
@@ -321,71 +382,67 @@ def withAuthors(path, books, undo):
     :param books: list of filenames to be modified
     """
     undo.clear()
-    to_rename = dict()
-    pattern = re.compile(r"_+\s.+(?=\.)") # finds a subtitle of a book
-    for book in books:
-        if ".kepub" in book:
-            old = book
-            to_rename[old] = renameBook(book.replace(".kepub", ""), pattern).replace(".epub", ".kepub.epub")
-        else:
-            old = book
-            to_rename[old] = renameBook(book, pattern)
-    for old, new in to_rename.items():
-        if new[-1] == "_":
-            undo[new[:-1]] = old
-            os.rename(path + old, path + new[:-1])
-            print(old, "changed to", new[:-1])
-        else:
-            undo[new] = old
-            try:
-                os.rename(path + old, path + new)
-                print(old, "changed to", new)
-            except FileExistsError: # prevents termination if multiple books would be renamed to a same new filename
+    counter = 0
+    existing = Counter(name.casefold() for name in os.listdir(path)) # checked for proposed names before renaming (ignoring case)
+    with dirRenamer(path) as rename:
+        for old in books:
+            if ".kepub" in old: new = renameBook(old.replace(".kepub", "")).replace(".epub", ".kepub.epub")
+            else: new = renameBook(old)
+            if new[-1] == "_": new = new[:-1]
+            if new == old: continue
+            renamed = False
+            while True:
+                # prevents overwriting if multiple books would be renamed to a same new filename (compared ignoring case,
+                # as case-insensitive file systems may replace a file differing in case only); old itself may be renamed to a change of case
+                taken = existing[new.casefold()] - (new.casefold() == old.casefold())
+                if new and new != old and not taken:
+                    try:
+                        rename(old, new)
+                        renamed = True
+                        break
+                    except FileExistsError: pass # e.g. file created after listing
                 while True:
                     exists = input("\nFile with proposed name {} already exists. Press N to enter a new filename or O to revert to old filename {}: ".format(new, old))
                     if exists in ["n", "N", "o", "O"]: break
-                if exists in ["n", "N"]:
-                    new = input("\nEnter a new filename: ")
-                    undo[new] = old
-                    os.rename(path + old, path + new)
-                    print("\n" + old, "changed to", new + "\n")
-                else: print("\nFile with name {} not renamed.\n".format(old))
-    print("\nProcess finished. {} filenames renamed with subtitles removed and authors retained.".format(len(to_rename)))
+                if exists in ["n", "N"]: new = input("\nEnter a new filename: ")
+                else: break
+            if not renamed:
+                print("\nFile with name {} not renamed.\n".format(old))
+                continue
+            existing[old.casefold()] -= 1
+            existing[new.casefold()] += 1
+            undo[new] = old
+            counter += 1
+            print(old, "changed to", new)
+    print("\nProcess finished. {} filenames renamed with subtitles removed and authors retained.".format(counter))
 
-def renameBook(book, pattern):
+@lru_cache(maxsize=4096)
+def renameBook(book):
     """
     Helper function for renaming books within function withAuthors.
+    Results are cached, so renaming the same filenames again (e.g. after restoring them) is not recomputed.
+    Moves a trailing article (see ARTICLES) in front of the title: "<author(s)> - <title>, <article>.extension" -> "<author(s)> - <article> <title>.extension"
     :param book: book to be renamed
-    :param pattern: regex pattern for finding subtitle
     :return: string of a renamed book
     """
-    # English
-    if re.search(r".+(, A)\.", book[-9:]): return re.sub("\s-\s", " - A ", re.sub(pattern, "", re.sub(",\sA\.", ".", book), 1), 1)
-    elif re.search(r".+(, An)\.", book[-10:]): return re.sub("\s-\s", " - An ", re.sub(pattern, "", re.sub(",\sAn\.", ".", book), 1), 1)
-    elif re.search(r".+(, The)\.", book[-11:]): return re.sub("\s-\s", " - The ", re.sub(pattern, "", re.sub(",\sThe\.", ".", book), 1), 1)
-    # Spanish
-    elif re.search(r".+(, El)\.", book[-10:]): return re.sub("\s-\s", " - El ", re.sub(pattern, "", re.sub(",\sEl\.", ".", book), 1), 1)
-    elif re.search(r".+(, La)\.", book[-10:]): return re.sub("\s-\s", " - La ", re.sub(pattern, "", re.sub(",\sLa\.", ".", book), 1), 1)
-    elif re.search(r".+(, Los)\.", book[-11:]): return re.sub("\s-\s", " - Los ", re.sub(pattern, "", re.sub(",\sLos\.", ".", book), 1), 1)
-    elif re.search(r".+(, Las)\.", book[-11:]): return re.sub("\s-\s", " - Las ", re.sub(pattern, "", re.sub(",\sLas\.", ".", book), 1), 1)
-    elif re.search(r".+(, Un)\.", book[-10:]): return re.sub("\s-\s", " - Un ", re.sub(pattern, "", re.sub(",\sUn\.", ".", book), 1), 1)
-    elif re.search(r".+(, Una)\.", book[-11:]): return re.sub("\s-\s", " - Una ", re.sub(pattern, "", re.sub(",\sUna\.", ".", book), 1), 1)
-    elif re.search(r".+(, Unos)\.", book[-12:]): return re.sub("\s-\s", " - Unos ", re.sub(pattern, "", re.sub(",\sUnos\.", ".", book), 1), 1)
-    elif re.search(r".+(, Unas)\.", book[-12:]): return re.sub("\s-\s", " - Unas ", re.sub(pattern, "", re.sub(",\sUnas\.", ".", book), 1), 1)
-    # French ("La", "Un" covered previously)
-    elif re.search(r".+(, Le)\.", book[-10:]): return re.sub("\s-\s", " - Le ", re.sub(pattern, "", re.sub(",\sLe\.", ".", book), 1), 1)
-    elif re.search(r".+(, L')\.", book[-10:]): return re.sub("\s-\s", " - L' ", re.sub(pattern, "", re.sub(",\sL'\.", ".", book), 1), 1)
-    elif re.search(r".+(, Les)\.", book[-11:]): return re.sub("\s-\s", " - Les ", re.sub(pattern, "", re.sub(",\sLes\.", ".", book), 1), 1)
-    elif re.search(r".+(, Une)\.", book[-11:]): return re.sub("\s-\s", " - Une ", re.sub(pattern, "", re.sub(",\sUne\.", ".", book), 1), 1)
-    elif re.search(r".+(, Des)\.", book[-11:]): return re.sub("\s-\s", " - Des ", re.sub(pattern, "", re.sub(",\sDes\.", ".", book), 1), 1)
-    # German
-    elif re.search(r".+(, Der)\.", book[-11:]): return re.sub("\s-\s", " - Der ", re.sub(pattern, "", re.sub(",\sDer\.", ".", book), 1), 1)
-    elif re.search(r".+(, Die)\.", book[-11:]): return re.sub("\s-\s", " - Die ", re.sub(pattern, "", re.sub(",\sDie\.", ".", book), 1), 1)
-    elif re.search(r".+(, Das)\.", book[-11:]): return re.sub("\s-\s", " - Das ", re.sub(pattern, "", re.sub(",\sDas\.", ".", book), 1), 1)
-    elif re.search(r".+(, Ein)\.", book[-11:]): return re.sub("\s-\s", " - Ein ", re.sub(pattern, "", re.sub(",\sEin\.", ".", book), 1), 1)
-    elif re.search(r".+(, Eine)\.", book[-12:]): return re.sub("\s-\s", " - Eine ", re.sub(pattern, "", re.sub(",\sEine\.", ".", book), 1), 1)
+    match = RE_ARTICLE.search(book)
+    if match: return cropSubtitle(book[:match.start()] + book[match.end():]).replace(" - ", " - {} ".format(match.group(1)), 1)
     # removes subtitle only
-    else: return re.sub(pattern, "", book, 1)
+    else: return cropSubtitle(book)
+
+def cropSubtitle(book):
+    """
+    Helper function for cropping subtitle from filename within functions withoutAuthors and renameBook.
+    Crops everything from the first "_ " (including preceding underscores) to the extension: "<title>_ <subtitle>.extension" -> "<title>.extension"
+    :param book: filename to crop subtitle from
+    :return: string of a filename without subtitle
+    """
+    dot = book.rfind(".")
+    if dot == -1: return book
+    start = book.find("_ ", 0, dot)
+    if start == -1: return book
+    while start and book[start - 1] == "_": start -= 1
+    return book[:start] + book[dot:]
 
 def restoreAuthors(path, books, undo):
     """
@@ -395,33 +452,34 @@ def restoreAuthors(path, books, undo):
         "Code", "Petzold, Charles - Code" -> match
         "Code", "Deibert, Ronald - Black Code" -> no match
     !!! Assumes identified books with author(s) data are structurally equal to corresponding books w/o author(s) data, but this is not guaranteed. !!!
-    !!! Complexity is O(n^2). !!!
+    !!! If multiple filenames in comparison directory have the same title data, the first one listed is used. !!!
     Stores new and old filenames to undo dictionary allowing restoration of modified filenames via undo method.
     :param path: full path to a directory with files to be modified
     :param books: list of filenames to have authors restored
     """
     undo.clear()
-    path2 = input("Enter path to other directory with books to compare: ")
+    path2 = getComparePath()
     books2 = os.listdir(path2)
     counter = 0
-    for book1 in books:
-        title1 = re.findall(r"(.+)\.", book1)
-        extension1 = re.findall(r"\.(\w+)", book1)
-        for book2 in books2:
-            if re.search(r"\.epub", book1.lower())\
-                    or re.search(r"\.mobi", book1.lower())\
-                    or re.search(r"\.pdf", book1.lower()): title2 = re.findall(r"\s-\s(.+)\.", book2)
-            if title2 and title1[0] == title2[0]:
-                new = re.findall(r".+\.", book2)[0] + extension1[0]
-                os.rename(path + book1, path + new)
+    titles = dict() # title data and names of filenames with author(s) data
+    for book2 in books2:
+        name2, extension2 = os.path.splitext(book2)
+        author2, dash, title2 = name2.partition(" - ")
+        if dash and title2 and extension2: titles.setdefault(title2, name2)
+    with dirRenamer(path) as rename:
+        for book1 in books:
+            if not book1.lower().endswith(EXTENSIONS): continue
+            title1, extension1 = os.path.splitext(book1)
+            name2 = titles.get(title1)
+            if name2:
+                new = name2 + extension1
+                rename(book1, new)
                 undo[new] = book1
                 counter += 1
                 print("{} changed to {}".format(book1, new))
-                break
-        print("Author(s) data not found for", book1)
+            else: print("Author(s) data not found for", book1)
     print("\nProcess finished. Author(s) data restored to {} filenames.".format(str(counter)))
 
-
 def removeSubstring(path, books, undo):
     """
     Removes a given substring from all filenames that contain substring or ignores otherwise.
@@ -433,15 +491,16 @@ def removeSubstring(path, books, undo):
     undo.clear()
     substring = input("Enter substring to remove from filename(s): ")
     counter = 0
-    for book in books:
-        if substring in book:
-            new = book.replace(substring, "", 1)
-            os.rename(path + book, path + new)
-            undo[new] = book
-            counter += 1
-            print("{} changed to {}".format(book, new))
-        else:
-            print("{} contains no substring {}".format(book, substring))
+    with dirRenamer(path) as rename:
+        for book in books:
+            if substring in book:
+                new = book.replace(substring, "", 1)
+                rename(book, new)
+                undo[new] = book
+                counter += 1
+                print("{} changed to {}".format(book, new))
+            else:
+                print("{} contains no substring {}".format(book, substring))
     print("\nProcess finished. Substring removed from {} filenames.".format(str(counter)))
 
 def restoreOld(path, undo):
@@ -456,18 +515,20 @@ def restoreOld(path, undo):
     counter = 0
     if not undo: print("No filenames to restore.")
     else:
-        for new, old in undo.items():
-            try:
-                os.rename(path + new, path + old)
-                counter += 1
-            except FileNotFoundError: print("{} not found in {}".format(new, path))
+        with dirRenamer(path) as rename:
+            for new, old in undo.items():
+                try:
+                    rename(new, old)
+                    counter += 1
+                except FileNotFoundError: print("{} not found in {}".format(new, path))
         print("Process finished. {} filenames restored.".format(counter))
 
 def compareTwoDirs(path, books):
     """
     Compares names without extensions of files in two directories (dir1, dir2).
-    Modify index boolean to set different similarity threshold (default: index >= 0.9).
-    !!! Complexity is O(|dir1|*|dir2|) and similarity ratios are slow to compute, so expect long running time for large inputs. !!!
+    Modify SIMILARITY constant to set different similarity threshold (default: 0.9).
+    Similarity ratios are computed by rapidfuzz if installed, otherwise by difflib for pairs of filenames
+    sharing enough shingles only (same result as comparing all pairs); see findSimilar.
     Prints a list of:
         identical files (except for extension) iff filenames found in both dirs
         pairs of similar files that are not identical (a filename can be similar to multiple filenames)
@@ -478,80 +539,153 @@ def compareTwoDirs(path, books):
     :param path: full path to a dir1 with files to be compared to files from dir2
     :param books: list of filenames from dir1 to be compared to filenames from dir2
     """
-    path2 = input("Enter path to other directory with books to compare: ")
+    path2 = getComparePath()
     books2 = os.listdir(path2)
     identical = list()
     similar = list()
     different = list()
-    if path2[-1] != "\\": path2 = path2 + "\\"
-    for book1 in books:
-        if re.search(r"\.epub", book1.lower())\
-                or re.search(r"\.mobi", book1.lower())\
-                or re.search(r"\.pdf", book1.lower()): b1 = re.sub(r"\.\w+", "", book1)
-        else: continue
-        not_found = True
-        for book2 in books2:
-            if re.search(r"\.epub", book2.lower())\
-                    or re.search(r"\.mobi", book2.lower())\
-                    or re.search(r"\.pdf", book2.lower()):
-                b2 = re.sub(r"\.\w+", "", book2)
-                index = difflib.SequenceMatcher(None, b1, b2).quick_ratio()
-                if index == 1:
-                    identical.append(b1)
-                    not_found = False
-                    break
-                elif index >= 0.9:
-                    similar.append((b1, b2))
-                    not_found = False
-        if not_found: different.append(b1)
+    names1 = [os.path.splitext(book1)[0] for book1 in books if book1.lower().endswith(EXTENSIONS)]
+    names2 = [os.path.splitext(book2)[0] for book2 in books2 if book2.lower().endswith(EXTENSIONS)]
+    found = set(names2)
+    not_identical = list()
+    for b1 in names1:
+        if b1 in found: identical.append(b1)
+        else: not_identical.append(b1)
+    for b1, matches in zip(not_identical, findSimilar(not_identical, names2)):
+        for i in matches: similar.append((b1, names2[i]))
+        if not matches: different.append(b1)
     print("\nBooks found in", path, "and", path2 + ":\n")
-    if identical:
-        for book in identical: print(book)
+    if identical: print("\n".join(identical))
     else: print("N/A")
     print("\nBooks in", path, "similar to books in", path2 + ":\n")
-    if similar:
-        for pair in similar: print(str(pair)[1:-1])
+    if similar: print("\n".join(str(pair)[1:-1] for pair in similar))
     else: print("N/A")
     print("\nBooks in", path, "not found in", path2 + ":\n")
-    if different:
-        for book in different: print(book)
+    if different: print("\n".join(different))
     else: print("N/A")
 
 def compareWithinDir(path, books):
     """
     Compares names without extensions of files within a directory (dir).
-    Modify index boolean to set different similarity threshold (default: index >= 0.9).
-    !!! Complexity is O(n^2) and similarity ratios are slow to compute, so expect long running time for large inputs. !!!
+    Modify SIMILARITY constant to set different similarity threshold (default: 0.9).
+    Similarity ratios are computed by rapidfuzz if installed, otherwise by difflib for pairs of filenames
+    sharing enough shingles only (same result as comparing all pairs); see findSimilar.
     Prints a list of:
-        pairs of similar files (a filename can be similar to multiple filenames)
-    !!! List of similar books contains double entries for pair of book1 : book2 and book2 : book1. !!!
+        pairs of similar files (a filename can be similar to multiple filenames, each pair is listed once)
     !!! False positives: distinct books with similar author(s) and/or title. !!!
     :param path: full path to a dir with files to be compared
     :param books: list of filenames from dir to be compared
     """
     similar = list()
-    for book1 in books:
-        if re.search(r"\.epub", book1.lower())\
-                or re.search(r"\.mobi", book1.lower())\
-                or re.search(r"\.pdf",book1.lower()): b1 = re.sub(r"\.\w+", "", book1)
-        else: continue
-        for book2 in books:
-            if book1 != book2\
-                    and (re.search(r"\.epub", book2.lower())\
-                    or re.search(r"\.mobi", book2.lower())\
-                    or re.search(r"\.pdf", book2.lower())):
-                b2 = re.sub(r"\.\w+", "", book2)
-                index = difflib.SequenceMatcher(None, b1, b2).quick_ratio()
-                if index >= 0.9: similar.append((b1, b2))
+    names = [os.path.splitext(book)[0] for book in books if book.lower().endswith(EXTENSIONS)]
+    for b1, matches in zip(names, findSimilar(names, names, within=True)):
+        for j in matches: similar.append((b1, names[j]))
     print("\nBooks in", path, "similar to books:\n")
-    if similar:
-        for pair in similar: print(str(pair)[1:-1])
+    if similar: print("\n".join(str(pair)[1:-1] for pair in similar))
     else: print("N/A")
 
+def findSimilar(names1, names2, within=False):
+    """
+    Helper function for finding similar names within functions compareTwoDirs and compareWithinDir.
+    If rapidfuzz is installed, computes matrices of similarity ratios (fuzz.ratio) of all pairs of names in parallel,
+    for up to ROWS names from names1 at once;
+    otherwise compares candidate pairs found via shingle index with difflib (see similarBooks).
+    !!! Ratios of rapidfuzz (normalized Indel similarity) can be slightly higher than those of difflib for the same pair. !!!
+    :param names1: list of names to find similar names for
+    :param names2: list of names to search
+    :param within: True if names1 and names2 are the same list; only names after a name are searched, so each pair is found once
+    :return: list of sorted lists of positions of names in names2 with similarity ratio >= SIMILARITY, one per name in names1
+    """
+    if not (names1 and names2): return [list() for name in names1]
+    if process:
+        similar = [list() for name in names1]
+        for start in range(0, len(names1), ROWS):
+            scores = process.cdist(names1[start:start + ROWS], names2, scorer=fuzz.ratio, score_cutoff=SIMILARITY * 100, workers=-1)
+            for i, j in zip(*scores.nonzero()):
+                if not within or j > start + i: similar[start + i].append(int(j))
+        return similar
+    index2 = shingleIndex(names2)
+    lengths2 = set(len(b2) for b2 in names2)
+    return [similarBooks(b1, names2, index2, lengths2, i + 1 if within else 0) for i, b1 in enumerate(names1)]
+
+def shingles(name):
+    """
+    Helper function returning a multiset of SHINGLE-character substrings (shingles) of a name.
+    :param name: name to split into shingles
+    :return: Counter of shingles of name
+    """
+    return Counter(name[i:i + SHINGLE] for i in range(len(name) - SHINGLE + 1))
+
+def shingleIndex(names):
+    """
+    Helper function for building an inverted index within function findSimilar.
+    :param names: list of names
+    :return: dictionary of shingles and lists of positions of names containing them
+    """
+    index = defaultdict(list)
+    for position, name in enumerate(names):
+        for shingle in shingles(name): index[shingle].append(position)
+    return index
+
+def minShared(length1, length2):
+    """
+    Helper function returning min number of shingles shared by names with similarity ratio >= SIMILARITY within function similarBooks.
+    Ratio >= SIMILARITY allows at most (1 - SIMILARITY) * (length1 + length2) inserted or deleted characters
+    and each of them removes at most SHINGLE shingles of the longer name.
+    :param length1: length of first name
+    :param length2: length of second name
+    :return: min number of shared shingles (<= 0 if names cannot be excluded by shingles)
+    """
+    edits = (1 - SIMILARITY) * (length1 + length2) + 1e-9 # rounding margin keeps the bound safe
+    return max(length1, length2) - SHINGLE + 1 - SHINGLE * edits
+
+def similarBooks(name, names, index, lengths, start=0):
+    """
+    Helper function for finding similar names with difflib within function findSimilar.
+    Similar names share at least minShared shingles with name (required is the lowest bound for lengths allowed by real_quick_ratio),
+    so they contain at least one shingle of name remaining after skipping its most frequent shingles (less than required occurrences).
+    Candidates are names containing the remaining shingles (looked up in inverted index)
+    whose number of shared shingles can still reach minShared for their length; names too short to share a shingle are all candidates.
+    Similarity ratio is computed only for candidates whose cheap upper bounds (real_quick_ratio, quick_ratio) reach SIMILARITY,
+    so the result is the same as comparing name with all names.
+    A single SequenceMatcher is reused with name as the second sequence, so its index of name is built only once.
+    :param name: name to find similar names for
+    :param names: list of names to search
+    :param index: inverted index of shingles of names
+    :param lengths: set of lengths of names
+    :param start: first position in names to search
+    :return: sorted list of positions of names with similarity ratio >= SIMILARITY
+    """
+    length = len(name)
+    limits = (length, length * SIMILARITY / (2 - SIMILARITY), length * (2 - SIMILARITY) / SIMILARITY) # bound is lowest at one of them
+    required = math.ceil(min(minShared(length, length2) for length2 in limits))
+    if required <= 0: candidates = range(start, len(names))
+    else:
+        name_shingles = shingles(name)
+        shared = defaultdict(int) # max number of shingles shared with name, excluding skipped shingles
+        skipped = 0
+        for shingle in sorted(name_shingles, key=lambda shingle: len(index.get(shingle, ())), reverse=True):
+            count = name_shingles[shingle]
+            if skipped + count < required: skipped += count # frequent shingle skipped
+            else:
+                for i in index.get(shingle, ()):
+                    if i >= start: shared[i] += count
+        bounds = {length2: minShared(length, length2) - skipped for length2 in lengths} # min number of counted shingles by length
+        candidates = sorted(i for i, count in shared.items() if count >= bounds[len(names[i])])
+    similar = list()
+    matcher = difflib.SequenceMatcher()
+    matcher.set_seq2(name)
+    for i in candidates:
+        matcher.set_seq1(names[i])
+        if matcher.real_quick_ratio() < SIMILARITY: continue
+        if matcher.quick_ratio() < SIMILARITY: continue
+        if matcher.ratio() >= SIMILARITY: similar.append(i)
+    return similar
+
 def compareSize(path, books):
     """
     Compares file sizes of identical filenames (excluding extension) between two directories (dir1, dir2).
-    !!! Complexity is O(log n). It is assumed and required that os.listdir returns a sorted array of filenames! !!!
+    Filenames from dir2 are indexed once by name, so each filename from dir1 is found with a single lookup.
     Set min difference between file sizes expressed as a share of sum of both file sizes (0 > share > 1):
         e.g. 0 returns all file pairs regardless of difference in file size
         e.g. 0.1 returns files iff size of file2 is <= 90% of size of file1
@@ -562,40 +696,30 @@ def compareSize(path, books):
     :param path: full path to a dir with files to be compared
     :param books: list of filenames from dir to be compared
     """
-    path2 = input("Enter path to other directory with books to compare: ")
+    path2 = getComparePath()
     while True:
         share = input("Enter min difference to check between file sizes as a share of file size (0 > share > 1): ")
         try: share = float(share)
         except TypeError: print("\nEnter a valid share.")
         if share >= 0 and share <= 1: break
         else: print("\nEnter a valid share.")
-    books2 = os.listdir(path2)
+    sizes1 = sizeMap(path)
+    sizes2 = sizeMap(path2)
     identical = list()
-    if path2[-1] != "\\": path2 = path2 + "\\"
+    names2 = dict() # lowercase names without extension and filenames from dir2
+    for book2 in sizes2:
+        b2 = stripLower(book2)
+        if b2 is not None: names2.setdefault(b2, book2)
     for book1 in books:
-        if re.search(r"\.epub", book1.lower())\
-                or re.search(r"\.mobi", book1.lower())\
-                or re.search(r"\.pdf", book1.lower()): b1 = re.sub(r"\.\w+", "", book1).lower()
-        else: continue
-        lower = 0
-        upper = len(books2)
-        while True:
-            if lower > upper: break
-            book2 = books2[((lower + upper) // 2)]
-            if re.search(r"\.epub", book2.lower())\
-                    or re.search(r"\.mobi", book2.lower())\
-                    or re.search(r"\.pdf", book2.lower()):
-                b2 = re.sub(r"\.\w+", "", book2).lower()
-                if b1 == b2:
-                    size1 = os.path.getsize(path + book1)
-                    size2 = os.path.getsize(path2 + book2)
-                    if size1 > size2 and size1 - size2 >= size1 * share:
-                        identical.append((size1, size2, "+" + str(round((((size1 - size2) / size1) * 100), 1)) + "%", re.sub(r"\.\w+", "", book1)))
-                    break
-                elif b1 < b2: upper = ((lower + upper) // 2) - 1
-                else: lower = ((lower + upper) // 2) + 1
-            elif b1 < b2: upper = ((lower + upper) // 2) - 1
-            else: lower = ((lower + upper) // 2) + 1
+        b1 = stripLower(book1)
+        if b1 is None or book1 not in sizes1: continue
+        book2 = names2.get(b1)
+        if book2:
+            size1 = sizes1[book1]
+            size2 = sizes2[book2]
+            if size1 > size2:
+                ratio = 1 - size2 / size1 # difference as a share of size1
+                if ratio >= share: identical.append((size1, size2, "+{:.1f}%".format(ratio * 100), os.path.splitext(book1)[0]))
     identical.sort(reverse=True)
     print("\nFILE SIZE 1  FILE SIZE 2  +%      FILE NAME\n")
     for pair in identical: print("{:>11}  {:>11}  {:>6}  {:}"
@@ -604,6 +728,28 @@ def compareSize(path, books):
                                          pair[2],
                                          pair[3]))
 
+@lru_cache(maxsize=None)
+def stripLower(book):
+    """
+    Helper function for getting names of books compared by name within function compareSize.
+    Results are cached, so comparing the same directories again (e.g. with reversed dirs) is not recomputed.
+    Cache is cleared when a new path is entered or the list of books is refreshed.
+    :param book: filename of a book
+    :return: lowercase name without extension, or None if extension is not in EXTENSIONS
+    """
+    name = book.lower()
+    if name.endswith(EXTENSIONS): return os.path.splitext(name)[0]
+    return None
+
+def sizeMap(path):
+    """
+    Helper function for getting file sizes from a single directory scan within function compareSize.
+    :param path: full path to a directory with files
+    :return: dictionary of filenames and file sizes in bytes
+    """
+    with os.scandir(path) as scan:
+        return {entry.name: entry.stat().st_size for entry in scan if entry.is_file()}
+
 def imageSize(path, books):
     """
     Displays filesize for cover.jp[e]g and directory size for \images above a specified threshold.
@@ -654,49 +800,55 @@ def imageSize(path, books):
                 print("Maximum number of images must be a non-negative integer.")
     if not (flag_cover or flag_images): return print("\nNo image checked.")
     print()
-    for book in books:
-        if re.search(r"\.epub", book.lower()):
-            size_cover = 0
-            size_images = 0
-            counter = 0
-            for info in ZF(path + book).infolist():
-                if flag_cover and info.filename.lower() in ["cover.jpg", "cover.jpeg"]: size_cover = int(info.file_size)
-                if flag_images and "images/" in info.filename.lower():
-                    size_images += int(info.file_size)
-                    counter += 1
-            if flag_cover and size_cover > cover: print("File cover.jpg in book {} larger than {} bytes -> {} bytes ({}%)."
-                                                        .format(book,
-                                                                cover,
-                                                                size_cover,
-                                                                round(size_cover / cover * 100, 1)))
-            if flag_images and limit >= counter and size_images > images: print("Directory \\images in book {} larger than {} bytes -> "
-                                                                                "{} bytes ({}%, {} images)."
-                                                                                .format(book,
-                                                                                        images,
-                                                                                        size_images,
-                                                                                        round(size_images / images * 100, 1),
-                                                                                        counter))
+    epubs = [book for book in books if book.lower().endswith(".epub")]
+    with ThreadPoolExecutor() as executor: # books are opened in parallel, results are kept in order of books
+        scans = list(executor.map(lambda book: scanEpub(os.path.join(path, book), flag_cover, flag_images), epubs))
+    for book, (sizes_cover, size_images, counter) in zip(epubs, scans):
+        size_cover = sizes_cover[-1] if sizes_cover else 0
+        if flag_cover and size_cover > cover: print("File cover.jpg in book {} larger than {} bytes -> {} bytes ({}%)."
+                                                    .format(book,
+                                                            cover,
+                                                            size_cover,
+                                                            round(size_cover / cover * 100, 1)))
+        if flag_images and limit >= counter and size_images > images: print("Directory \\images in book {} larger than {} bytes -> "
+                                                                            "{} bytes ({}%, {} images)."
+                                                                            .format(book,
+                                                                                    images,
+                                                                                    size_images,
+                                                                                    round(size_images / images * 100, 1),
+                                                                                    counter))
 
 def imageAll(path, books):
     """
     List cover.jp[e]g files and \images directories for all books in .epub format, sorted by size descending.
+    Optional limit of number of largest cover.jp[e]g files and \\images directories to list.
     :param path: full path to a dir with files to have images checked
     :param books: list of filenames from dir to have images checked
     """
+    top = None
+    while True:
+        try:
+            input_top_str = input("Enter number of largest cover.jp[e]g files and \\images directories to list or D for default (all): ")
+            if input_top_str in ["d", "D"]: break
+            input_top = int(input_top_str)
+            assert input_top >= 0
+            top = input_top
+            break
+        except (ValueError, AssertionError) as e: print("Number of files and directories must be a non-negative integer.")
     covers = list()
     images = list()
-    for book in books:
-        if re.search(r"\.epub", book.lower()):
-            size_images = 0
-            counter = 0
-            for info in ZF(path + book).infolist():
-                if info.filename.lower() in ["cover.jpg", "cover.jpeg"]: covers.append((info.file_size, book))
-                if "images/" in info.filename.lower():
-                    size_images += int(info.file_size)
-                    counter += 1
-            if size_images: images.append((size_images, book, str(counter)))
-    covers.sort(reverse=True)
-    images.sort(reverse=True)
+    epubs = [book for book in books if book.lower().endswith(".epub")]
+    with ThreadPoolExecutor() as executor: # books are opened in parallel, results are kept in order of books
+        scans = list(executor.map(lambda book: scanEpub(os.path.join(path, book)), epubs))
+    for book, (sizes_cover, size_images, counter) in zip(epubs, scans):
+        for size_cover in sizes_cover: covers.append((size_cover, book))
+        if size_images: images.append((size_images, book, str(counter)))
+    if top is None:
+        covers.sort(reverse=True)
+        images.sort(reverse=True)
+    else: # partial sort of only the largest
+        covers = nlargest(top, covers)
+        images = nlargest(top, images)
     print()
     for c in covers:
         if len(c[1]) > 51: print("cover.jp[e]g in {:<55} {:>7} bytes".format(c[1][:51] + "...", c[0]))
@@ -706,6 +858,39 @@ def imageAll(path, books):
         if len(i[1]) > 54: print("\images in {:<60} {:>7} bytes {:>6} images".format(i[1][:54] + "...", i[0], i[2]))
         else: print("\images in {:<60} {:>7} bytes {:>6} images".format(i[1], i[0], i[2]))
 
+def scanEpub(epub_path, flag_cover=True, flag_images=True):
+    """
+    Helper function for reading sizes of images from a single .epub file within functions imageSize and imageAll.
+    Only the central directory of the archive is read, images are not extracted.
+    :param epub_path: full path to a .epub file
+    :param flag_cover: True if cover.jp[e]g files are checked
+    :param flag_images: True if \\images directories are checked
+    :return: tuple of list of cover.jp[e]g file sizes, \\images directory size and number of images
+    """
+    sizes_cover = list()
+    size_images = 0
+    counter = 0
+    with ZF(epub_path) as epub: infos = epub.infolist()
+    for info in infos:
+        name = info.filename.lower()
+        if flag_cover and name in COVER_FILENAMES: sizes_cover.append(info.file_size)
+        elif flag_images and (name.startswith("images/") or "/images/" in name):
+            size_images += info.file_size
+            counter += 1
+    return sizes_cover, size_images, counter
+
+def prepareCollectionsDB(connection, books):
+    """
+    Helper function for preparing KoboReader.sqlite database connection within functions checkCollectionsDB and cleanCollectionsDB.
+    Registers SQL function basename(ContentId) and fills temporary table tmp_books with book filenames on device,
+    so entries not found on device can be selected by SQLite with a single query.
+    :param connection: connection to KoboReader.sqlite database
+    :param books: list of filenames from dir to be checked against database
+    """
+    connection.create_function("basename", 1, lambda content: content.rpartition("/")[2], deterministic=True)
+    connection.execute("CREATE TEMP TABLE tmp_books(name TEXT PRIMARY KEY)")
+    connection.executemany("INSERT OR IGNORE INTO tmp_books VALUES (?)", ((book,) for book in books))
+
 def checkCollectionsDB(books):
     """
     Checks book filenames in collections in KoboReader.sqlite database
@@ -716,19 +901,17 @@ def checkCollectionsDB(books):
     :param device: path to the main dir of Kobo device
     """
     device = input("Enter path to the main directory of Kobo device: ")
-    if device[-1] != "\\": device = device + "\\"
-    books_sorted = sorted(books)
+    database = os.path.join(device, ".kobo", "KoboReader.sqlite")
     counter = 0
-    connection = sqlite3.connect(device + ".kobo\\KoboReader.sqlite")
+    connection = sqlite3.connect(database)
+    prepareCollectionsDB(connection, books)
     cursor = connection.cursor()
-    cursor.execute("SELECT ShelfName, ContentId FROM ShelfContent")
+    cursor.execute("SELECT ShelfName, basename(ContentId) FROM ShelfContent "
+                   "WHERE basename(ContentId) NOT IN (SELECT name FROM tmp_books)")
     print("\n")
-    for row in cursor.fetchall():
-        book = re.sub(r".+/", "", row[1])
-        if not binarySearch(books_sorted, book):
-            counter += 1
-            print("Entry {} from collection {} not found in book filenames on device.".format(book, row[0]))
-    connection.commit()
+    for row in cursor:
+        counter += 1
+        print("Entry {} from collection {} not found in book filenames on device.".format(row[1], row[0]))
     connection.close()
     print("\nProcess finished. {} entries not found in book filenames on device.".format(str(counter)))
 
@@ -742,9 +925,7 @@ def cleanCollectionsDB(books):
     :param device: path to the main dir of Kobo device
     """
     device = input("Enter path to the main directory of Kobo device: ")
-    if device[-1] != "\\": device = device + "\\"
-    books_sorted = sorted(books)
-    counter = 0
+    database = os.path.join(device, ".kobo", "KoboReader.sqlite")
     while True:
         backup = input("\nCreate a backup of KoboReader.sqlite database? Y/N ")
         if backup in ["Y", "N", "y", "n"]: break
@@ -752,95 +933,97 @@ def cleanCollectionsDB(books):
     if backup in ["Y", "y"]:
         print("\nCreating backup of KoboReader.sqlite database...")
         # creates backup of database
-        copy2(device + ".kobo\\KoboReader.sqlite", device + ".kobo\\KoboReader - Copy.sqlite")
-        print("Backup of KoboReader.sqlite database created in location {}.kobo\\KoboReader - Copy.sqlite".format(device))
+        backup_database = os.path.join(device, ".kobo", "KoboReader - Copy.sqlite")
+        copy2(database, backup_database)
+        print("Backup of KoboReader.sqlite database created in location {}".format(backup_database))
     print("\n")
-    connection = sqlite3.connect(device + ".kobo\\KoboReader.sqlite")
+    # autocommit mode, the transaction is opened and committed explicitly, so loading tmp_books and removing entries are written to device once
+    connection = sqlite3.connect(database, isolation_level=None)
     cursor = connection.cursor()
-    cursor.execute("SELECT ShelfName, ContentId FROM ShelfContent")
-    for row in cursor.fetchall():
-        book = re.sub(r".+/", "", row[1])
-        if not binarySearch(books_sorted, book):
-            cursor.execute("DELETE FROM ShelfContent WHERE ContentId = ?", (row[1],))
-            counter += 1
-            print("Entry {} from collection {} removed from database.".format(book, row[0]))
-    connection.commit()
+    cursor.execute("BEGIN")
+    prepareCollectionsDB(connection, books)
+    cursor.execute("SELECT ShelfName, basename(ContentId) FROM ShelfContent "
+                   "WHERE basename(ContentId) NOT IN (SELECT name FROM tmp_books)")
+    for row in cursor:
+        print("Entry {} from collection {} removed from database.".format(row[1], row[0]))
+    cursor.execute("DELETE FROM ShelfContent WHERE basename(ContentId) NOT IN (SELECT name FROM tmp_books)")
+    counter = cursor.rowcount
+    cursor.execute("COMMIT")
     connection.close()
     print("\nProcess finished. {} entries removed from collections.".format(str(counter)))
 
-def binarySearch(iterable, item):
+@contextmanager
+def dirRenamer(path):
     """
-    Performs a binary search on a sorted iterable.
-    !!! Requires a sorted iterable. !!!
-    :param iterable: iterable to search
-    :param item: item to search for
-    :return: if item found: item; if item not found: False
+    Helper context manager yielding a function rename(old, new) for renaming files within a directory.
+    Where supported (POSIX), the directory is opened once and files are renamed relative to its file descriptor,
+    so the full path is not resolved again for every rename; otherwise falls back to os.rename with joined paths.
+    :param path: full path to a directory with files to be renamed
     """
-    low = 0
-    high = len(iterable)
-    while high > low:
-        mid = (low + high) // 2
-        if iterable[mid] == item: return item
-        elif iterable[mid] < item: low = mid + 1
-        else: high = mid
-    return False
+    if os.rename in os.supports_dir_fd and hasattr(os, "O_DIRECTORY"):
+        directory = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try: yield lambda old, new: os.rename(old, new, src_dir_fd=directory, dst_dir_fd=directory)
+        finally: os.close(directory)
+    else: yield lambda old, new: os.rename(os.path.join(path, old), os.path.join(path, new))
 
 ### MAIN ###
 
+HELP = {0: "Changes path to directory with book filenames.",
+        1: "Refreshes list of books from path.",
+        2: selectBooks,
+        3: removeMultipleSpacing,
+        4: fixCommaSpacing,
+        5: fixApostrophes,
+        6: findHypenWithoutSpacing,
+        7: findNoAuthorFirst,
+        8: findMissingCapitalization,
+        9: findSubtitles,
+        10: withoutAuthors,
+        11: withAuthors,
+        12: restoreAuthors,
+        13: removeSubstring,
+        14: restoreOld,
+        15: compareTwoDirs,
+        16: compareWithinDir,
+        17: compareSize,
+        18: imageSize,
+        19: imageAll,
+        20: checkCollectionsDB,
+        21: cleanCollectionsDB,
+        22: "Chooses a book at random."} # help text or function documented for each option
+OPTIONS = {3: (removeMultipleSpacing, "pbu"),
+           4: (fixCommaSpacing, "pbu"),
+           5: (fixApostrophes, "pbu"),
+           6: (findHypenWithoutSpacing, "pb"),
+           7: (findNoAuthorFirst, "pb"),
+           8: (findMissingCapitalization, "pb"),
+           9: (findSubtitles, "b"),
+           10: (withoutAuthors, "pbu"),
+           11: (withAuthors, "pbu"),
+           12: (restoreAuthors, "pbu"),
+           13: (removeSubstring, "pbu"),
+           14: (restoreOld, "pu"),
+           15: (compareTwoDirs, "pb"),
+           16: (compareWithinDir, "pb"),
+           17: (compareSize, "pb"),
+           18: (imageSize, "pb"),
+           19: (imageAll, "pb"),
+           20: (checkCollectionsDB, "b"),
+           21: (cleanCollectionsDB, "b"),
+           22: (lambda books: print(ch(books)), "b")} # function and its arguments (path, books, undo) for each option
+
 undo = dict()
+compare_path = None
 path = getPath()
 books = getBooks(path)
 while True:
     while True:
-        choice = input("{} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {} {}"
-                       .format("\n0: enter new path",
-                               "\n1: refresh list of books from path",
-                               "\n2: select individual books for processing",
-                               "\n3: remove multiple spacing",
-                               "\n4: fix comma spacing",
-                               "\n5: fix apostrophes",
-                               "\n6: find hyphen without spacing",
-                               "\n7: find possible missing authors at the start",
-                               "\n8: find possible missing capitalization",
-                               "\n9: find books containing possible subtitles",
-                               "\n10: preserve title(s) only (crop author(s), subtitle(s))",
-                               "\n11: preserve author(s) and title(s) (crop subtitle(s))",
-                               "\n12: restore author(s) data to filename(s) w/o author(s) data",
-                               "\n13: remove substring from filename",
-                               "\n14: restore filenames after modification",
-                               "\n15: compare filenames from two directories",
-                               "\n16: compare filenames within single directory",
-                               "\n17: compare file sizes of identical books",
-                               "\n18: find image files above threshold size (.epub format only)",
-                               "\n19: list all cover.jp[e]g files and \\images directories sorted by size (.epub format only)",
-                               "\n20: check the database on Kobo device for inaccurate collections data",
-                               "\n21: remove inaccurate collections data from the database on Kobo device",
-                               "\n22: choose a book at random",
-                               "\n\nEnter number, H+number for help, or X for exit: "))
+        choice = input(MENU)
         if choice == "X" or choice == "x": quit()
-        elif choice == "H0" or choice == "h0":   print("Changes path to directory with book filenames.")
-        elif choice == "H1" or choice == "h1":   print("Refreshes list of books from path.")
-        elif choice == "H2" or choice == "h2":   help(selectBooks)
-        elif choice == "H3" or choice == "h3":   help(removeMultipleSpacing)
-        elif choice == "H4" or choice == "h4":   help(fixCommaSpacing)
-        elif choice == "H5" or choice == "h5":   help(fixApostrophes)
-        elif choice == "H6" or choice == "h6":   help(findHypenWithoutSpacing)
-        elif choice == "H7" or choice == "h7":   help(findNoAuthorFirst)
-        elif choice == "H8" or choice == "h8":   help(findMissingCapitalization)
-        elif choice == "H9" or choice == "h9":   help(findSubtitles)
-        elif choice == "H10" or choice == "h10": help(withoutAuthors)
-        elif choice == "H11" or choice == "h11": help(withAuthors)
-        elif choice == "H12" or choice == "h12": help(restoreAuthors)
-        elif choice == "H13" or choice == "h13": help(removeSubstring)
-        elif choice == "H14" or choice == "h14": help(restoreOld)
-        elif choice == "H15" or choice == "h15": help(compareTwoDirs)
-        elif choice == "H16" or choice == "h16": help(compareWithinDir)
-        elif choice == "H17" or choice == "h17": help(compareSize)
-        elif choice == "H18" or choice == "h18": help(imageSize)
-        elif choice == "H19" or choice == "h19": help(imageAll)
-        elif choice == "H20" or choice == "h20": help(checkCollectionsDB)
-        elif choice == "H21" or choice == "h21": help(cleanCollectionsDB)
-        elif choice == "H22" or choice == "h22": help(random)
+        elif choice[:1] in ("H", "h") and choice[1:].isdigit() and int(choice[1:]) in HELP:
+            option = HELP[int(choice[1:])]
+            if isinstance(option, str): print(option)
+            else: help(option)
         else:
             try:
                 number = int(choice)
@@ -850,97 +1033,25 @@ while True:
                     undo = dict()
                     path = getPath()
                     books = getBooks(path)
+                    stripLower.cache_clear()
                     print("New path:", path)
                     break
                 if number == 1:
                     print()
                     books = getBooks(path)
+                    stripLower.cache_clear()
                     print("List of books from path {} refreshed.".format(path))
                     break
                 if number == 2:
                     print()
                     books = selectBooks()
                     break
-                elif number == 3:
-                    print()
-                    removeMultipleSpacing(path, books, undo)
-                    break
-                elif number == 4:
-                    print()
-                    fixCommaSpacing(path, books, undo)
-                    break
-                elif number == 5:
-                    print()
-                    fixApostrophes(path, books, undo)
-                    break
-                elif number == 6:
-                    print()
-                    findHypenWithoutSpacing(path, books)
-                    break
-                elif number == 7:
-                    print()
-                    findNoAuthorFirst(path, books)
-                    break
-                elif number == 8:
-                    print()
-                    findMissingCapitalization(path, books)
-                    break
-                elif number == 9:
-                    print()
-                    findSubtitles(books)
-                    break
-                elif number == 10:
-                    print()
-                    withoutAuthors(path, books, undo)
-                    break
-                elif number == 11:
-                    print()
-                    withAuthors(path, books, undo)
-                    break
-                elif number == 12:
-                    print()
-                    restoreAuthors(path, books, undo)
-                    break
-                elif number == 13:
-                    print()
-                    removeSubstring(path, books, undo)
-                    break
-                elif number == 14:
-                    print()
-                    restoreOld(path, undo)
-                    break
-                elif number == 15:
-                    print()
-                    compareTwoDirs(path, books)
-                    break
-                elif number == 16:
-                    print()
-                    compareWithinDir(path, books)
-                    break
-                elif number == 17:
-                    print()
-                    compareSize(path, books)
-                    break
-                elif number == 18:
-                    print()
-                    imageSize(path, books)
-                    break
-                elif number == 19:
-                    print()
-                    imageAll(path, books)
-                    break
-                elif number == 20:
-                    print()
-                    checkCollectionsDB(books)
-                    break
-                elif number == 21:
-                    print()
-                    cleanCollectionsDB(books)
-                    break
-                elif number == 22:
+                elif number in OPTIONS:
                     print()
-                    print(ch(books))
+                    function, args = OPTIONS[number]
+                    arguments = {"p": path, "b": books, "u": undo}
+                    function(*(arguments[arg] for arg in args))
                     break
                 else: print("\nEnter a valid number.")
             except ValueError: print("\nEnter a valid choice.")
-print("\nFinished in %s seconds." % "{0:.3f}".format(time() - start))
\ No newline at end of file
+    print("\nFinished in %s seconds." % "{0:.3f}".format(time() - start))